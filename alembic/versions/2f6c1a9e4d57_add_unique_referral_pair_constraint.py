@@ -0,0 +1,45 @@
+"""Add unique (user_tg_id, friend_tg_id) constraint to referrals
+
+Revision ID: 2f6c1a9e4d57
+Revises: 8d37e419b0b3
+Create Date: 2026-10-15 10:41:27.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f6c1a9e4d57'
+down_revision: Union[str, None] = '8d37e419b0b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # The old SELECT-then-INSERT could race; keep the oldest row of each pair.
+    op.execute("""
+        DELETE FROM referrals a
+        USING referrals b
+        WHERE a.user_tg_id = b.user_tg_id
+          AND a.friend_tg_id = b.friend_tg_id
+          AND a.id > b.id
+    """)
+    # Build the constraint's index without blocking reads or writes, then
+    # attach it; ADD CONSTRAINT ... USING INDEX only needs a brief lock. The
+    # unique index covers the same columns as the old composite one.
+    # CONCURRENTLY cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('uq_referrals_pair', 'referrals', ['user_tg_id', 'friend_tg_id'],
+                        unique=True, postgresql_concurrently=True)
+        op.execute("ALTER TABLE referrals ADD CONSTRAINT uq_referrals_pair UNIQUE USING INDEX uq_referrals_pair")
+        op.drop_index('ix_referrals_user_friend', table_name='referrals',
+                      postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referrals_user_friend', 'referrals', ['user_tg_id', 'friend_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_constraint('uq_referrals_pair', 'referrals', type_='unique')
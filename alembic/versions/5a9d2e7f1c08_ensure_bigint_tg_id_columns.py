@@ -0,0 +1,31 @@
+"""Ensure referrals tg_id columns are BIGINT
+
+Revision ID: 5a9d2e7f1c08
+Revises: b41e0c7d93a2
+Create Date: 2026-10-15 11:48:16.204519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9d2e7f1c08'
+down_revision: Union[str, None] = 'b41e0c7d93a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # The table predates the migrations and may have been created with
+    # INTEGER or VARCHAR ids; this is a no-op when the columns are already BIGINT.
+    op.alter_column('referrals', 'user_tg_id', type_=sa.BigInteger(),
+                    postgresql_using='user_tg_id::bigint')
+    op.alter_column('referrals', 'friend_tg_id', type_=sa.BigInteger(),
+                    postgresql_using='friend_tg_id::bigint')
+
+def downgrade():
+    # Nothing to undo: the pre-migration type is unknown and BIGINT is what the model declares.
+    pass
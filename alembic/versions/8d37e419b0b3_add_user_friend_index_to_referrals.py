@@ -0,0 +1,31 @@
+"""Add composite (user_tg_id, friend_tg_id) index to referrals
+
+Revision ID: 8d37e419b0b3
+Revises: 767dd645ca38
+Create Date: 2026-10-15 10:12:04.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d37e419b0b3'
+down_revision: Union[str, None] = '767dd645ca38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # CONCURRENTLY keeps referral inserts running while the index builds; it
+    # cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referrals_user_friend', 'referrals', ['user_tg_id', 'friend_tg_id'],
+                        postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_referrals_user_friend', table_name='referrals',
+                      postgresql_concurrently=True)
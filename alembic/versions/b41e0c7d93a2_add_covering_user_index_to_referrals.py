@@ -0,0 +1,37 @@
+"""Add covering user_tg_id index to referrals
+
+Revision ID: b41e0c7d93a2
+Revises: 2f6c1a9e4d57
+Create Date: 2026-10-15 11:05:52.361870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41e0c7d93a2'
+down_revision: Union[str, None] = '2f6c1a9e4d57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Lets SUM(points) WHERE user_tg_id = ? run as an index-only scan; it also
+    # replaces the plain user_tg_id index. CONCURRENTLY keeps referral inserts
+    # running; it cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_ref_user_covering', 'referrals', ['user_tg_id'],
+                        postgresql_include=['points', 'friend_tg_id', 'date', 'id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_referrals_user_tg_id', table_name='referrals',
+                      postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referrals_user_tg_id', 'referrals', ['user_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_ref_user_covering', table_name='referrals',
+                      postgresql_concurrently=True)
@@ -0,0 +1,36 @@
+"""Add (friend_tg_id, user_tg_id) index to referrals
+
+Revision ID: c7e3f05a2b61
+Revises: 5a9d2e7f1c08
+Create Date: 2026-10-15 13:22:40.771902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e3f05a2b61'
+down_revision: Union[str, None] = '5a9d2e7f1c08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Serves friend_tg_id lookups on its own, so the single-column index goes.
+    # CONCURRENTLY keeps referral inserts running; it cannot run inside the
+    # migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_ref_friend_user', 'referrals', ['friend_tg_id', 'user_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_referrals_friend_tg_id', table_name='referrals',
+                      postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referrals_friend_tg_id', 'referrals', ['friend_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_ref_friend_user', table_name='referrals',
+                      postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Replace the (friend_tg_id, user_tg_id) index with a plain friend_tg_id index
+
+Revision ID: e19a4b6c0d35
+Revises: c7e3f05a2b61
+Create Date: 2026-10-15 14:03:11.458026
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e19a4b6c0d35'
+down_revision: Union[str, None] = 'c7e3f05a2b61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # The only friend_tg_id read is the bitmap scan in the referral loader,
+    # which reads the heap anyway, so the trailing user_tg_id only cost writes.
+    # CONCURRENTLY keeps referral inserts running while the index builds; it
+    # cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referrals_friend_tg_id', 'referrals', ['friend_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_ref_friend_user', table_name='referrals',
+                      postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_ref_friend_user', 'referrals', ['friend_tg_id', 'user_tg_id'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_referrals_friend_tg_id', table_name='referrals',
+                      postgresql_concurrently=True)
@@ -0,0 +1,47 @@
+"""Add user_points counter table
+
+Revision ID: f3b8d1e62a74
+Revises: e19a4b6c0d35
+Create Date: 2026-10-15 14:51:36.092417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d1e62a74'
+down_revision: Union[str, None] = 'e19a4b6c0d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'user_points',
+        sa.Column('tg_id', sa.BigInteger(), primary_key=True, autoincrement=False),
+        sa.Column('points', sa.Integer(), nullable=False, server_default='0'),
+    )
+    # referrals predates the migrations and its columns are nullable; rows
+    # without a referrer have no counter to feed.
+    op.execute("""
+        INSERT INTO user_points (tg_id, points)
+        SELECT user_tg_id, COALESCE(SUM(points), 0) FROM referrals
+        WHERE user_tg_id IS NOT NULL
+        GROUP BY user_tg_id
+    """)
+    # Points are now read from user_points, so nothing needs the INCLUDE
+    # columns anymore; uq_referrals_pair's leading user_tg_id serves the
+    # remaining lookups.
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_ref_user_covering', table_name='referrals',
+                      postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_ref_user_covering', 'referrals', ['user_tg_id'],
+                        postgresql_include=['points', 'friend_tg_id', 'date', 'id'],
+                        postgresql_concurrently=True)
+    op.drop_table('user_points')
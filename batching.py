@@ -0,0 +1,233 @@
+import abc
+import asyncio
+import logging
+import os
+from sqlalchemy import select, bindparam, tuple_, text, or_, any_, BigInteger
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from database import SessionLocal
+from models import Referral
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("REFERRAL_BATCH_SIZE", 200))
+BATCH_DELAY = float(os.getenv("REFERRAL_BATCH_DELAY", 0.01))
+LOAD_BATCH_SIZE = int(os.getenv("REFERRAL_LOAD_BATCH_SIZE", 200))
+LOAD_BATCH_DELAY = float(os.getenv("REFERRAL_LOAD_BATCH_DELAY", 0.002))
+# Upper bound on how long a caller waits for its batch, queueing included.
+SUBMIT_TIMEOUT = float(os.getenv("REFERRAL_SUBMIT_TIMEOUT", 10))
+
+referrals = Referral.__table__
+_columns = (
+    referrals.c.id, referrals.c.user_tg_id, referrals.c.friend_tg_id,
+    referrals.c.date, referrals.c.points, referrals.c.username
+)
+
+DEFAULT_POINTS = referrals.c.points.default.arg
+
+# One round trip per batch: insert the new pairs, add their points to each
+# referrer's user_points counter and read back the pairs that already existed.
+# The final SELECT runs on the statement's snapshot, so it never sees rows
+# inserted by the CTE itself.
+_upsert_stmt = text("""
+    WITH batch AS (
+        SELECT * FROM unnest(CAST(:u AS BIGINT[]), CAST(:f AS BIGINT[]), CAST(:n AS TEXT[]))
+            AS b(user_tg_id, friend_tg_id, username)
+    ), ins AS (
+        INSERT INTO referrals (user_tg_id, friend_tg_id, username, points, date)
+        SELECT user_tg_id, friend_tg_id, username, CAST(:points AS INTEGER), now() FROM batch
+        ON CONFLICT (user_tg_id, friend_tg_id) DO NOTHING
+        RETURNING id, user_tg_id, friend_tg_id, date, points, username
+    ), counters AS (
+        INSERT INTO user_points (tg_id, points)
+        SELECT user_tg_id, SUM(points) FROM ins GROUP BY user_tg_id ORDER BY user_tg_id
+        ON CONFLICT (tg_id) DO UPDATE SET points = user_points.points + EXCLUDED.points
+    )
+    SELECT ins.*, true AS created FROM ins
+    UNION ALL
+    SELECT r.id, r.user_tg_id, r.friend_tg_id, r.date, r.points, r.username, false
+    FROM referrals r JOIN batch USING (user_tg_id, friend_tg_id)
+""")
+# Fallback for pairs committed by a concurrent transaction after the
+# snapshot above was taken.
+_existing_stmt = select(*_columns).where(
+    tuple_(referrals.c.user_tg_id, referrals.c.friend_tg_id).in_(bindparam("pairs", expanding=True))
+)
+
+
+# = ANY(:ids) keeps the SQL text identical for any number of ids.
+_load_stmt = select(*_columns).where(or_(
+    referrals.c.user_tg_id == any_(bindparam("ids", type_=ARRAY(BigInteger))),
+    referrals.c.friend_tg_id == any_(bindparam("ids", type_=ARRAY(BigInteger))),
+))
+
+
+class Batcher(abc.ABC):
+    """Queues items from concurrent callers and hands them to _flush() in batches.
+
+    A batch is flushed once ``batch_size`` items are waiting or ``delay``
+    seconds after its first item arrived, whichever comes first. _flush()
+    must resolve every future in the batch or raise. If a batch raises one of
+    ``split_on`` (errors a single bad row can cause), its items are retried
+    one by one so that row only fails its own caller; any other error, such
+    as a lost connection or a timeout, fails the whole batch at once.
+    """
+
+    split_on = (DataError, IntegrityError)
+
+    def __init__(self, batch_size: int, delay: float):
+        self.batch_size = batch_size
+        self.delay = delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        # A timed-out future is cancelled and dropped from its batch.
+        return await asyncio.wait_for(future, SUBMIT_TIMEOUT)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush_safely(batch)
+
+    async def _flush_safely(self, batch):
+        # Skip callers that already gave up waiting.
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        try:
+            await self._flush(batch)
+        except Exception as e:
+            if len(batch) == 1 or not isinstance(e, self.split_on):
+                logger.error("Error flushing %s batch of %d: %s", type(self).__name__, len(batch), e)
+                self._fail(batch, e)
+                return
+            logger.warning("%s batch of %d failed (%s); retrying items one by one",
+                           type(self).__name__, len(batch), e)
+            for item in batch:
+                await self._flush_safely([item])
+
+    @abc.abstractmethod
+    async def _flush(self, batch):
+        """Resolve the future of every ``(item, future)`` pair in ``batch``, or raise."""
+
+    @staticmethod
+    def _fail(batch, exc: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+
+class ReferralBatcher(Batcher):
+    """Coalesces concurrent referral inserts into one multi-row statement.
+
+    submit() resolves to ``(row, created)`` once the batch containing it has
+    been committed; ``created`` is False when the pair already existed.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, delay: float = BATCH_DELAY):
+        super().__init__(batch_size, delay)
+
+    async def submit(self, user_tg_id: int, friend_tg_id: int, username=None):
+        return await self._submit(
+            {"user_tg_id": user_tg_id, "friend_tg_id": friend_tg_id, "username": username}
+        )
+
+    async def _flush(self, batch):
+        # The same pair may be submitted twice within one batch.
+        rows = {}
+        for row, _ in batch:
+            rows.setdefault((row["user_tg_id"], row["friend_tg_id"]), row)
+        # Insert in key order so concurrent batches with overlapping pairs take
+        # their index locks in the same order instead of deadlocking.
+        rows = dict(sorted(rows.items()))
+        async with SessionLocal.begin() as db:
+            result = await db.execute(_upsert_stmt, {
+                "u": [pair[0] for pair in rows],
+                "f": [pair[1] for pair in rows],
+                "n": [row["username"] for row in rows.values()],
+                "points": DEFAULT_POINTS,
+            })
+            found = {}
+            for r in result.mappings():
+                r = dict(r)
+                created = r.pop("created")
+                found[(r["user_tg_id"], r["friend_tg_id"])] = (r, created)
+            missing = [pair for pair in rows if pair not in found]
+            if missing:
+                result = await db.execute(_existing_stmt, {"pairs": missing})
+                for r in result.mappings():
+                    found[(r["user_tg_id"], r["friend_tg_id"])] = (dict(r), False)
+
+        resolved = set()
+        for row, future in batch:
+            pair = (row["user_tg_id"], row["friend_tg_id"])
+            result_row, created = found[pair]
+            # Only the first submitter of a freshly inserted pair sees created=True.
+            created = created and pair not in resolved
+            resolved.add(pair)
+            if not future.done():
+                future.set_result((result_row, created))
+
+
+class ReferralLoader(Batcher):
+    """Serves concurrent referral-list lookups with one query per batch.
+
+    load(tg_id) resolves to every referral where ``tg_id`` is either side of
+    the pair, the same rows get_referrals would select for it on its own.
+    """
+
+    # ids are bounded to BIGINT before they get here, so no single id can fail
+    # _load_stmt; a failed load batch is an outage and fails all its callers.
+    split_on = ()
+
+    def __init__(self, batch_size: int = LOAD_BATCH_SIZE, delay: float = LOAD_BATCH_DELAY):
+        super().__init__(batch_size, delay)
+
+    async def load(self, tg_id: int):
+        return await self._submit(tg_id)
+
+    async def _flush(self, batch):
+        by_id = {tg_id: [] for tg_id, _ in batch}
+        async with SessionLocal.begin() as db:
+            result = await db.execute(_load_stmt, {"ids": list(by_id)})
+            rows = [dict(r) for r in result.mappings()]
+
+        for row in rows:
+            if row["user_tg_id"] in by_id:
+                by_id[row["user_tg_id"]].append(row)
+            if row["friend_tg_id"] in by_id and row["friend_tg_id"] != row["user_tg_id"]:
+                by_id[row["friend_tg_id"]].append(row)
+        for tg_id, future in batch:
+            if not future.done():
+                # Callers may mutate their list; don't share one between duplicate ids.
+                future.set_result(list(by_id[tg_id]))
+
+
+referral_batcher = ReferralBatcher()
+referral_loader = ReferralLoader()
@@ -0,0 +1,91 @@
+import logging
+import os
+import orjson
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Caching is disabled when REDIS_URL is not set.
+REDIS_URL = os.getenv("REDIS_URL")
+POINTS_TTL = int(os.getenv("CACHE_POINTS_TTL", 60))
+REFERRALS_TTL = int(os.getenv("CACHE_REFERRALS_TTL", 120))
+# Version keys must outlive every value stored under them: once one expires the
+# user's version restarts from 0, which is only safe after the old values are gone.
+VERSION_TTL = max(int(os.getenv("CACHE_VERSION_TTL", 86400)), 2 * max(POINTS_TTL, REFERRALS_TTL))
+
+redis = Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Per-process counters, exposed through /meta/cache-stats; each gunicorn
+# worker keeps its own.
+stats = {"hits": 0, "misses": 0}
+
+# Values live under "{name}:{tg_id}:v{version}". A write bumps the user's
+# version instead of deleting keys, so a reader that loaded from the database
+# before the write can only store its result under a version nobody reads
+# anymore.
+POINTS = "pts"
+REFERRALS = "refs"
+
+def version_key(tg_id: int) -> str:
+    return f"ver:{tg_id}"
+
+async def get_json(key: str):
+    if redis is None:
+        return None
+    try:
+        value = await redis.get(key)
+    except RedisError as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+    return orjson.loads(value) if value is not None else None
+
+async def set_json(key: str, value, ttl: int):
+    if redis is None:
+        return
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl)
+    except RedisError as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
+
+async def get_or_compute(name: str, tg_id: int, ttl: int, loader):
+    """Return the cached ``name`` value for ``tg_id``, or await ``loader()`` and cache its result."""
+    if redis is None:
+        stats["misses"] += 1
+        return await loader()
+    try:
+        # Read the version before loading so a concurrent invalidate() wins.
+        version = int(await redis.get(version_key(tg_id)) or 0)
+    except RedisError as e:
+        logger.warning("Cache version read failed for %s: %s", tg_id, e)
+        stats["misses"] += 1
+        return await loader()
+    key = f"{name}:{tg_id}:v{version}"
+    value = await get_json(key)
+    if value is not None:
+        stats["hits"] += 1
+        return value
+    stats["misses"] += 1
+    value = await loader()
+    await set_json(key, value, ttl)
+    return value
+
+async def invalidate(*tg_ids: int):
+    """Retire every cached value of the given users by bumping their versions."""
+    if redis is None:
+        return
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            for tg_id in tg_ids:
+                pipe.incr(version_key(tg_id))
+                pipe.expire(version_key(tg_id), VERSION_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning("Cache invalidation failed for %s: %s", tg_ids, e)
+
+async def close():
+    if redis is not None:
+        await redis.aclose()
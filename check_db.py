@@ -1,27 +1,18 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from main import User, Referral, DATABASE_URL
+import asyncio
+from sqlalchemy import select
+from database import SessionLocal, engine
+from models import Referral
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-
-def check_db():
-    db = SessionLocal()
-    try:
-        print("Users:")
-        users = db.query(User).all()
-        for user in users:
-            print(f"ID: {user.id}, TG_ID: {user.tg_id}, Username: {user.username}, Points: {user.points}")
-
-        print("\nReferrals:")
-        referrals = db.query(Referral).all()
-        for referral in referrals:
+async def check_db():
+    async with SessionLocal() as db:
+        print("Referrals:")
+        result = await db.execute(select(Referral))
+        for referral in result.scalars():
             print(
                 f"ID: {referral.id}, User TG_ID: {referral.user_tg_id}, Friend TG_ID: {referral.friend_tg_id}, Points: {referral.points}")
-    finally:
-        db.close()
+    await engine.dispose()
 
 
 if __name__ == "__main__":
-    check_db()
\ No newline at end of file
+    asyncio.run(check_db())
\ No newline at end of file
@@ -1,20 +1,63 @@
-from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import asyncio
 import os
+from uuid import uuid4
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# These are per worker, and gunicorn already runs 2*ncpu+1 workers: keep
+# workers * (POOL_SIZE + MAX_OVERFLOW) below Postgres' max_connections
+# (or PgBouncer's max_client_conn when DATABASE_PGBOUNCER is set).
+POOL_SIZE = int(os.getenv("SQLALCHEMY_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 5))
+POOL_TIMEOUT = int(os.getenv("SQLALCHEMY_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.getenv("SQLALCHEMY_POOL_RECYCLE", 1800))
+QUERY_CACHE_SIZE = int(os.getenv("SQLALCHEMY_QUERY_CACHE_SIZE", 1200))
+# Connections opened per worker at startup; every worker does this at once.
+POOL_WARM = min(POOL_SIZE, int(os.getenv("SQLALCHEMY_POOL_WARM", 2)))
+
+# asyncpg prepares each statement once per connection and reuses it. PgBouncer
+# in transaction mode hands each transaction a different server connection,
+# so there the caches must be off.
+PGBOUNCER = os.getenv("DATABASE_PGBOUNCER") == "1"
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("SQLALCHEMY_PREPARED_STATEMENT_CACHE_SIZE", 100))
+CONNECT_ARGS = {
+    "statement_cache_size": 0,
+    "prepared_statement_cache_size": 0,
+    "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+} if PGBOUNCER else {
+    "prepared_statement_cache_size": PREPARED_STATEMENT_CACHE_SIZE,
+}
+
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args=CONNECT_ARGS,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=POOL_RECYCLE,
+    query_cache_size=QUERY_CACHE_SIZE,
+)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+async def warm_pool():
+    """Open POOL_WARM connections up front so early requests skip connection setup."""
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await asyncio.gather(*(ping() for _ in range(POOL_WARM)))
+
+# The session only checks out a connection on its first query; wrap queries in
+# `async with db.begin():` to hand it back before the response is serialized.
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -0,0 +1,17 @@
+import multiprocessing
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+class Worker(UvicornWorker):
+    # Pin the fast loop and parser instead of relying on "auto", and skip
+    # per-request access log lines.
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "access_log": False}
+
+
+bind = "0.0.0.0:8000"
+
+worker_class = Worker
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "warning")
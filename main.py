@@ -1,21 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Path, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
 from datetime import datetime
+from contextlib import asynccontextmanager
+import hashlib
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
-from database import get_db
-from models import Referral
+from database import get_db, engine, Base, warm_pool
+from models import UserPoints
+import cache
+from batching import referral_batcher, referral_loader
 
-logging.basicConfig(level=logging.INFO)
+# Handlers write from a background thread so request coroutines never block on
+# the stream lock; the listener is started and flushed in the lifespan below.
+_log_queue = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = QueueListener(_log_queue, _log_stream)
+# The queued record must carry only the message; the listener's handler adds the prefix.
+_log_handler = QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), handlers=[_log_handler])
 logger = logging.getLogger(__name__)
 
+# referrals.*_tg_id and user_points.tg_id are BIGINT; asyncpg rejects anything
+# outside that range, so reject it up front with a 422.
+BIGINT_MIN = -2**63
+BIGINT_MAX = 2**63 - 1
+
 class ReferralCreate(BaseModel):
-    user_tg_id: int
-    friend_tg_id: int
-    username: str = None
+    user_tg_id: int = Field(ge=BIGINT_MIN, le=BIGINT_MAX)
+    friend_tg_id: int = Field(ge=BIGINT_MIN, le=BIGINT_MAX)
+    username: Optional[str] = None
 
 class ReferralResponse(BaseModel):
     id: int
@@ -23,63 +47,146 @@ class ReferralResponse(BaseModel):
     friend_tg_id: int
     date: datetime
     points: int
-    username: str = None
+    username: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Built once so every request reuses the same compiled SQL from the engine cache.
+# Read paths use plain Core table columns: no ORM entities, identity map or
+# attribute instrumentation, just row mappings.
+user_points = UserPoints.__table__
+_get_points_stmt = select(user_points.c.points).where(user_points.c.tg_id == bindparam("tg"))
+
+# Arbitrary application-wide key for pg_advisory_xact_lock.
+SCHEMA_LOCK_KEY = 0x7265666572
+_schema_lock_stmt = text("SELECT pg_advisory_xact_lock(%d)" % SCHEMA_LOCK_KEY)
+
+CACHE_CONTROL = "private, max-age=15"
 
-    class Config:
-        orm_mode = True
+def _etag(*parts, weak: bool = False) -> str:
+    tag = '"' + hashlib.md5(":".join(map(str, parts)).encode()).hexdigest() + '"'
+    return "W/" + tag if weak else tag
 
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
 
-app = FastAPI()
+def _not_modified(request: Request, etag: str) -> bool:
+    # If-None-Match uses weak comparison (RFC 9110 §13.1.2), so W/ is ignored on both sides.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return _opaque_tag(etag) in [_opaque_tag(t.strip()) for t in if_none_match.split(",")]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _log_listener.start()
+    # Production schema comes from `alembic upgrade head`; this is for local dev only.
+    if os.getenv("AUTO_CREATE_SCHEMA") == "1":
+        async with engine.begin() as conn:
+            # Every gunicorn worker runs this; the lock makes them take turns so
+            # only the first creates tables and the rest find them in place.
+            await conn.execute(_schema_lock_stmt)
+            await conn.run_sync(Base.metadata.create_all)
+    await warm_pool()
+    referral_batcher.start()
+    referral_loader.start()
+    yield
+    await referral_loader.stop()
+    await referral_batcher.stop()
+    await cache.close()
+    await engine.dispose()
+    _log_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Comma-separated; the Mini App frontend is the only expected caller.
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "https://etoshutka.github.io").split(",")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization", "ngrok-skip-browser-warning"],
+    max_age=86400,
 )
 
+# Referral lists compress well; tiny bodies like /points stay uncompressed.
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+
+# Per-request lines log at DEBUG: a QueueHandler still formats each record on
+# the event loop, so only created or failed referrals log at INFO.
+#
+# Routes return ORJSONResponse directly: rows come straight from our own
+# database (or its cache), so FastAPI's response_model re-validation is skipped
+# and response_model only documents the schema.
 @app.post("/referrals/", response_model=ReferralResponse)
-def create_referral(referral: ReferralCreate, db: Session = Depends(get_db)):
-    logger.info(f"Attempting to create referral: {referral}")
-    existing_referral = db.query(Referral).filter(
-        Referral.user_tg_id == referral.user_tg_id,
-        Referral.friend_tg_id == referral.friend_tg_id
-    ).first()
-
-    if existing_referral:
-        logger.info(f"Existing referral found: {existing_referral}")
-        return existing_referral
-
-    new_referral = Referral(user_tg_id=referral.user_tg_id,
-                            friend_tg_id=referral.friend_tg_id,
-                            username=referral.username
-                            )
+async def create_referral(referral: ReferralCreate):
+    logger.debug("Attempting to create referral: %s", referral)
     try:
-        db.add(new_referral)
-        db.commit()
-        db.refresh(new_referral)
-        logger.info(f"New referral created successfully: {new_referral}")
-        return new_referral
+        row, created = await referral_batcher.submit(
+            referral.user_tg_id, referral.friend_tg_id, referral.username
+        )
     except Exception as e:
-        logger.error(f"Error creating referral: {str(e)}")
-        db.rollback()
+        logger.error("Error creating referral: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create referral")
+    if not created:
+        logger.debug("Existing referral found: %s", row)
+        return ORJSONResponse(row)
+    # Both users' referral lists change; only the referrer's points do, but
+    # versions are per user so bumping both covers everything.
+    await cache.invalidate(referral.user_tg_id, referral.friend_tg_id)
+    logger.info("New referral created successfully: %s", row)
+    return ORJSONResponse(row)
 
 @app.get("/referrals/{tg_id}", response_model=list[ReferralResponse])
-def get_referrals(tg_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Fetching referrals for tg_id: {tg_id}")
-    referrals = db.query(Referral).filter(
-        (Referral.user_tg_id == tg_id) | (Referral.friend_tg_id == tg_id)
-    ).all()
-    logger.info(f"Found {len(referrals)} referrals for tg_id: {tg_id}")
-    return referrals
+async def get_referrals(request: Request, tg_id: int = Path(ge=BIGINT_MIN, le=BIGINT_MAX)):
+    async def load():
+        logger.debug("Fetching referrals for tg_id: %s", tg_id)
+        # Concurrent lookups for different users share one batched query.
+        rows = await referral_loader.load(tg_id)
+        logger.debug("Found %d referrals for tg_id: %s", len(rows), tg_id)
+        return rows
+
+    rows = await cache.get_or_compute(cache.REFERRALS, tg_id, cache.REFERRALS_TTL, load)
+    # Referrals are never updated or deleted, so the count and newest id identify the list.
+    # Weak because GZipMiddleware may send the same list gzipped or plain.
+    etag = _etag(tg_id, len(rows), max((row["id"] for row in rows), default=0), weak=True)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(rows, headers=headers)
 
 @app.get("/referrals/{tg_id}/points")
-def get_user_points(tg_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Calculating points for tg_id: {tg_id}")
-    referrals = db.query(Referral).filter(Referral.user_tg_id == tg_id).all()
-    total_points = sum(referral.points for referral in referrals)
-    logger.info(f"Total points for tg_id {tg_id}: {total_points}")
-    return {"total_points": total_points}
+async def get_user_points(request: Request, tg_id: int = Path(ge=BIGINT_MIN, le=BIGINT_MAX),
+                          db: AsyncSession = Depends(get_db)):
+    async def load():
+        logger.debug("Calculating points for tg_id: %s", tg_id)
+        async with db.begin():
+            result = await db.execute(_get_points_stmt, {"tg": tg_id})
+            total_points = result.scalar_one_or_none() or 0
+        logger.debug("Total points for tg_id %s: %s", tg_id, total_points)
+        return {"total_points": total_points}
+
+    points = await cache.get_or_compute(cache.POINTS, tg_id, cache.POINTS_TTL, load)
+    etag = _etag(tg_id, points["total_points"])
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(points, headers=headers)
 
+@app.get("/meta/cache-stats")
+async def get_cache_stats():
+    # Counters live in each worker process, so these cover only the worker
+    # that served this request.
+    lookups = cache.stats["hits"] + cache.stats["misses"]
+    return {
+        "enabled": cache.redis is not None,
+        "scope": "worker",
+        "pid": os.getpid(),
+        **cache.stats,
+        "hit_rate": cache.stats["hits"] / lookups if lookups else 0.0,
+    }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, BigInteger,String
+from sqlalchemy import Column, Integer, DateTime, BigInteger,String, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -7,8 +7,23 @@ from database import Base
 class Referral(Base):
     __tablename__ = "referrals"
     id = Column(Integer, primary_key=True, index=True)
-    user_tg_id = Column(BigInteger, index=True)
+    user_tg_id = Column(BigInteger)
     friend_tg_id = Column(BigInteger, index=True)
     date = Column(DateTime, default=func.now())
     points = Column(Integer, default=100)
-    username = Column(String, nullable=True)
\ No newline at end of file
+    username = Column(String, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_tg_id", "friend_tg_id", name="uq_referrals_pair"),
+    )
+
+
+class UserPoints(Base):
+    """Running total of Referral.points per referrer (user_tg_id).
+
+    Incremented in the same statement that inserts referrals; see
+    reconcile_points.py for recomputing it from the referrals table.
+    """
+    __tablename__ = "user_points"
+    tg_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    points = Column(Integer, nullable=False, default=0, server_default="0")
\ No newline at end of file
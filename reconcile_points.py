@@ -0,0 +1,33 @@
+"""Recompute user_points from the referrals table.
+
+A manual repair tool, not a cron job: it holds a SHARE lock on referrals,
+blocking every referral insert, for a full-table GROUP BY. Run it only after
+the counters are known to have drifted, e.g. after editing referrals by hand.
+"""
+import asyncio
+from sqlalchemy import text
+from database import SessionLocal, engine
+
+# SHARE mode blocks referral inserts for the duration, so no increment can land
+# between the SUM and the overwrite.
+LOCK_REFERRALS = text("LOCK TABLE referrals IN SHARE MODE")
+RECONCILE = text("""
+    INSERT INTO user_points (tg_id, points)
+    SELECT user_tg_id, COALESCE(SUM(points), 0) FROM referrals
+    WHERE user_tg_id IS NOT NULL
+    GROUP BY user_tg_id
+    ON CONFLICT (tg_id) DO UPDATE SET points = EXCLUDED.points
+    WHERE user_points.points IS DISTINCT FROM EXCLUDED.points
+""")
+
+
+async def reconcile_points():
+    async with SessionLocal.begin() as db:
+        await db.execute(LOCK_REFERRALS)
+        result = await db.execute(RECONCILE)
+        print(f"Corrected points for {result.rowcount} users")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(reconcile_points())
\ No newline at end of file